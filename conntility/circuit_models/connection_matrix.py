@@ -1,20 +1,119 @@
 # SPDX-License-Identifier: Apache-2.0
 # For loading connectivity matrices
 import h5py
+import libsonata
 import numpy
+import threading
 import tqdm
 import pandas
 import os
+from concurrent.futures import ThreadPoolExecutor
 from scipy import sparse
 
 from .neuron_groups.defaults import GID
 from .sonata_helpers import LOCAL_CONNECTOME, find_sonata_connectome, get_connectome_shape
 
 STR_VOID = "VOID"
+# Enlarged HDF5 chunk cache for access patterns dominated by repeated small index reads
+RDCC_NBYTES = 256 * 1024 * 1024
+# Selections above this fraction of the population are faster through one bulk read
+# of the whole connectome than through per-gid index traversal
+LOAD_FULL_FRACTION = 0.05
+
+
+def _maybe_mmap(dset):
+    """
+    Returns a read-only numpy.memmap view of a contiguously stored (unchunked,
+    uncompressed) HDF5 dataset, bypassing libhdf5's internal copy. Returns None
+    if the dataset layout does not permit memory mapping.
+    """
+    offset = dset.id.get_offset()
+    if offset is None or dset.chunks is not None:
+        return None
+    return numpy.memmap(dset.file.filename, dtype=dset.dtype, mode="r",
+                        offset=offset, shape=dset.shape)
+
+
+def _read_slice(dset, fr, to, buf):
+    """
+    Reads dset[fr:to], either as a zero-copy view of a memory-mapped array or via
+    Dataset.read_direct into the provided reusable buffer.
+    """
+    if isinstance(dset, numpy.ndarray):
+        out = dset[fr:to]
+        if out.dtype == numpy.uint64:  # reinterpret for bincount & friends
+            out = out.view(numpy.int64)
+        return out
+    dset.read_direct(buf, numpy.s_[fr:to], numpy.s_[:to - fr])
+    return buf[:to - fr]
+
+
+def _as_index_arrays(indices, indptr, n_rows):
+    """
+    Converts indices/indptr lists to arrays, using int32 where the matrix dimensions
+    and nonzero count permit it -- half the index memory of the int64 default.
+    """
+    idx_dtype = numpy.int32 if max(n_rows, len(indices)) < 2 ** 31 else numpy.int64
+    return numpy.asarray(indices, dtype=idx_dtype), numpy.asarray(indptr, dtype=idx_dtype)
+
+
+def _read_blocks(dset, blocks, total):
+    """
+    Reads and concatenates dset[fr:to] for every (fr, to) in blocks into one pre-sized
+    array: a single allocation plus one read_direct per block, instead of a Python list
+    of small arrays joined through numpy.hstack.
+    """
+    out = numpy.empty(total, dtype=dset.dtype)
+    pos = 0
+    for fr, to in blocks:
+        n = int(to - fr)
+        dset.read_direct(out, numpy.s_[fr:to], numpy.s_[pos:pos + n])
+        pos += n
+    return out
+
+
+def _thread_local_edge_datasets(sonata_fn, population, buf_sz):
+    """
+    Returns two callables (get, close). get yields per-thread (source dataset, target
+    dataset, source buffer, target buffer). Contiguously stored datasets are memory-mapped
+    once and shared between threads (numpy.memmap is safe for concurrent reads). Otherwise,
+    h5py file handles must not be shared across threads, so each worker thread opens the
+    file once and keeps its own pair of read buffers. close closes all per-thread file
+    handles deterministically.
+    """
+    with h5py.File(sonata_fn, "r") as h5:
+        grp = h5['edges/%s' % population]
+        mm_src = _maybe_mmap(grp['source_node_id'])
+        mm_tgt = _maybe_mmap(grp['target_node_id'])
+    local = threading.local()
+    handles = []
+    lock = threading.Lock()
+
+    def get():
+        if mm_src is not None and mm_tgt is not None:
+            return mm_src, mm_tgt, None, None
+        if not hasattr(local, "src_dset"):
+            h5 = h5py.File(sonata_fn, "r")
+            with lock:
+                handles.append(h5)
+            grp = h5['edges/%s' % population]
+            local.src_dset = mm_src if mm_src is not None else grp['source_node_id']
+            local.tgt_dset = mm_tgt if mm_tgt is not None else grp['target_node_id']
+            local.buf_src = numpy.empty(buf_sz, dtype=numpy.int64)
+            local.buf_tgt = numpy.empty(buf_sz, dtype=numpy.int64)
+        return local.src_dset, local.tgt_dset, local.buf_src, local.buf_tgt
+
+    def close():
+        with lock:
+            for h5 in handles:
+                h5.close()
+            handles.clear()
+    return get, close
 
 
 def full_connection_matrix(sonata_fn, n_neurons=None, population="default",
-                           edge_property=None, agg_func=None, shape=None, chunk=50000000):
+                           edge_property=None, agg_func=None, shape=None, chunk=50000000,
+                           n_workers=4):
     """
     Returns the full connection matrix encoded in a sonata h5 file.
     Input:
@@ -28,6 +127,8 @@ def full_connection_matrix(sonata_fn, n_neurons=None, population="default",
     Must be provided if edge_property is provided!
     chunk (optional): Number of connections to read at the same time. Larger values
     will run generally faster, but with fewer updates of the progress bar.
+    n_workers (optional): Number of threads reading chunks concurrently. h5py releases the
+    GIL inside reads, so this overlaps HDF5 I/O with the counting / scatter work.
 
     Returns:
     scipy.sparse matrix of connectivity
@@ -36,19 +137,82 @@ def full_connection_matrix(sonata_fn, n_neurons=None, population="default",
         assert agg_func is not None, "Must also provide a list of functions to aggregate synapses belonging to the same connection!"
         return _full_connection_property(sonata_fn, edge_property, agg_func, n_neurons=n_neurons,
                                          population=population, shape=shape, chunk=chunk)
-    h5 = h5py.File(sonata_fn, "r")['edges/%s' % population]
     if n_neurons is not None and shape is None:
         shape = (n_neurons, n_neurons)
+    infer_shape = shape is None
 
-    dset_sz = h5['source_node_id'].shape[0]
-    A = numpy.zeros(dset_sz, dtype=int)
-    B = numpy.zeros(dset_sz, dtype=int)
+    with h5py.File(sonata_fn, "r") as h5:
+        dset_sz = h5['edges/%s' % population]['source_node_id'].shape[0]
     splits = numpy.arange(0, dset_sz + chunk, chunk)
-    for splt_fr, splt_to in tqdm.tqdm(zip(splits[:-1], splits[1:]), total=len(splits) - 1):
-        A[splt_fr:splt_to] = h5['source_node_id'][splt_fr:splt_to]
-        B[splt_fr:splt_to] = h5['target_node_id'][splt_fr:splt_to]
-    M = sparse.coo_matrix((numpy.ones_like(A, dtype=bool), (A, B)), shape=shape)
-    return M.tocsr()
+    splits[-1] = dset_sz
+    bounds = list(zip(splits[:-1], splits[1:]))
+    get_dsets, close_dsets = _thread_local_edge_datasets(sonata_fn, population, min(chunk, dset_sz))
+
+    # Pass 1: count edges per source node to get the CSR indptr directly.
+    def count_chunk(chunk_bounds):
+        splt_fr, splt_to = chunk_bounds
+        src_dset, tgt_dset, buf_src, buf_tgt = get_dsets()
+        cnt = numpy.bincount(_read_slice(src_dset, splt_fr, splt_to, buf_src))
+        mx = -1
+        if infer_shape:
+            mx = int(_read_slice(tgt_dset, splt_fr, splt_to, buf_tgt).max())
+        return cnt, mx
+
+    counts = numpy.zeros(0, dtype=numpy.int64)
+    max_tgt = -1
+    chunk_counts = []
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for cnt, mx in tqdm.tqdm(pool.map(count_chunk, bounds), desc="Counting...", total=len(bounds)):
+            chunk_counts.append(cnt)
+            if len(cnt) > len(counts):
+                cnt = cnt.copy()
+                cnt[:len(counts)] += counts
+                counts = cnt
+            else:
+                counts[:len(cnt)] += cnt
+            max_tgt = max(max_tgt, mx)
+    if shape is None:
+        shape = (len(counts), max_tgt + 1)
+    if len(counts) < shape[0]:
+        counts = numpy.pad(counts, (0, shape[0] - len(counts)))
+    indptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+
+    # Pass 2: scatter target ids into their final CSR slots, avoiding the
+    # intermediate COO representation and its nnz-sized sort. Each chunk owns a
+    # disjoint set of slots (its per-source base cursors), so chunks can run in
+    # parallel.
+    idx_dtype = numpy.int32 if shape[1] < 2 ** 31 else numpy.int64
+    indices = numpy.empty(dset_sz, dtype=idx_dtype)
+
+    def fill_chunk(chunk_bounds, base):
+        splt_fr, splt_to = chunk_bounds
+        src_dset, tgt_dset, buf_src, buf_tgt = get_dsets()
+        A = _read_slice(src_dset, splt_fr, splt_to, buf_src)
+        B = _read_slice(tgt_dset, splt_fr, splt_to, buf_tgt)
+        order = numpy.argsort(A, kind="stable")
+        A = A[order]
+        # offset of each edge within its source's run of this chunk
+        rank = numpy.arange(len(A)) - numpy.searchsorted(A, A, side="left")
+        indices[base[A] + rank] = B[order]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        pending = []
+        base = indptr[:-1].copy()
+        for chunk_bounds, cnt in tqdm.tqdm(zip(bounds, chunk_counts), desc="Filling...", total=len(bounds)):
+            pending.append(pool.submit(fill_chunk, chunk_bounds, base.copy()))
+            base[:len(cnt)] += cnt
+            # bounded prefetch: cap the number of in-flight per-chunk cursor copies
+            while len(pending) > 2 * n_workers:
+                pending.pop(0).result()
+        for fut in pending:
+            fut.result()
+    close_dsets()
+
+    if dset_sz < 2 ** 31:
+        indptr = indptr.astype(numpy.int32)
+    M = sparse.csr_matrix((numpy.ones(dset_sz, dtype=bool), indices, indptr), shape=shape)
+    M.sum_duplicates()
+    return M
 
 
 def _full_connection_property(sonata_fn, edge_property, agg_func, n_neurons=None, population="default",
@@ -71,7 +235,8 @@ def _full_connection_property(sonata_fn, edge_property, agg_func, n_neurons=None
     """
     if not isinstance(agg_func, list):
         raise NotImplementedError("Currently only implemented for list-of-functions")
-    h5 = h5py.File(sonata_fn, "r")['edges/%s' % population]
+    h5_file = h5py.File(sonata_fn, "r")
+    h5 = h5_file['edges/%s' % population]
     if n_neurons is not None and shape is None:
         shape = (n_neurons, n_neurons)
 
@@ -91,6 +256,7 @@ def _full_connection_property(sonata_fn, edge_property, agg_func, n_neurons=None
         for afunc in agg_func:
             out_data[afunc].extend(S[afunc].values)
 
+    h5_file.close()
     M = dict([
         (afunc,
          sparse.coo_matrix((out_data[afunc], (row_indices, col_indices)), shape=shape).tocsr())
@@ -99,7 +265,8 @@ def _full_connection_property(sonata_fn, edge_property, agg_func, n_neurons=None
     return M
 
 
-def _connection_property_for_gids(sonata_fn, gids, gids_post, population, edge_property, agg_func):
+def _connection_property_for_gids(sonata_fn, gids, gids_post, population, edge_property, agg_func,
+                                  edges=None, chunk=None):
     """
     Returns the connection matrix encoded in a sonata h5 file for a subset of neurons.
     Input:
@@ -111,11 +278,20 @@ def _connection_property_for_gids(sonata_fn, gids, gids_post, population, edge_p
     agg_func: if a callable: A function to aggregate multiple synapse properties into a single,
                              scalar connection property (has to work with pandas' `.apply()`)
               if a list: A list of the above described aggregation functions (has to work with pandas' `.agg()`)
+    edges (optional): An already opened h5py.Group of the edge population. If not provided,
+                      the file is opened for the duration of the call and closed again.
+    chunk (optional): Ignored. Accepted so that callers can forward it regardless of which
+                      reader ends up serving the request; reads here are range-sized already.
 
     Returns:
     scipy.sparse matrix of connectivity (or a dict of those if a list is passed as `agg_func`)
     """
-    h5 = h5py.File(sonata_fn, "r")['edges/%s' % population]
+    if edges is None:
+        with h5py.File(sonata_fn, "r", rdcc_nbytes=RDCC_NBYTES) as h5_file:
+            return _connection_property_for_gids(sonata_fn, gids, gids_post, population,
+                                                 edge_property, agg_func,
+                                                 edges=h5_file['edges/%s' % population])
+    h5 = edges
 
     idx = numpy.array(gids)
     if gids_post is None:
@@ -125,56 +301,60 @@ def _connection_property_for_gids(sonata_fn, gids, gids_post, population, edge_p
     N = len(gids)
     M = len(gids_post)
 
+    # Cache the two bookkeeping index datasets in RAM up front; issuing two tiny
+    # h5py reads per post-synaptic gid would dominate for long gid lists.
+    node_id_to_ranges = h5['indices']['target_to_source']['node_id_to_ranges'][:]
+    range_to_edge_id = h5['indices']['target_to_source']['range_to_edge_id'][:]
+
     indices = []
     indptr = [0]
     if not isinstance(agg_func, list):
         data = []
         for id_post in tqdm.tqdm(idx_post):
-            ids_pre = []
-            data_pre = []
-            ranges = h5['indices']['target_to_source']['node_id_to_ranges'][id_post, :]
-            for block in h5['indices']['target_to_source']['range_to_edge_id'][ranges[0]:ranges[1], :]:
-                ids_pre.append(h5['source_node_id'][block[0]:block[1]])
-                data_pre.append(h5['0'][edge_property][block[0]:block[1]])
-
-            if len(ids_pre) > 0:
-                ids_pre = numpy.hstack(ids_pre)
+            ranges = node_id_to_ranges[id_post, :]
+            blocks = range_to_edge_id[ranges[0]:ranges[1], :]
+            total = int((blocks[:, 1] - blocks[:, 0]).sum()) if len(blocks) else 0
+
+            if total > 0:
+                ids_pre = _read_blocks(h5['source_node_id'], blocks, total)
                 row_ids = rv_index[rv_index.index.intersection(ids_pre)].values
                 indices.extend(row_ids)
-                data_pre = pandas.Series(numpy.hstack(data_pre), index=ids_pre)
+                data_pre = pandas.Series(_read_blocks(h5['0'][edge_property], blocks, total),
+                                         index=ids_pre)
                 data_pre = data_pre[data_pre.index.intersection(idx)]
                 data.extend(data_pre.groupby(level=0, group_keys=False).apply(agg_func).values)
 
             indptr.append(len(indices))
+        indices, indptr = _as_index_arrays(indices, indptr, N)
         mat = sparse.csc_matrix((data, indices, indptr), shape=(N, M))
         return mat
     else:
         data = {agg_f: [] for agg_f in agg_func}
         for id_post in tqdm.tqdm(idx_post):
-            ids_pre = []
-            data_pre = []
-            ranges = h5['indices']['target_to_source']['node_id_to_ranges'][id_post, :]
-            for block in h5['indices']['target_to_source']['range_to_edge_id'][ranges[0]:ranges[1], :]:
-                ids_pre.append(h5['source_node_id'][block[0]:block[1]])
-                data_pre.append(h5['0'][edge_property][block[0]:block[1]])
-
-            if len(ids_pre) > 0:
-                ids_pre = numpy.hstack(ids_pre)
+            ranges = node_id_to_ranges[id_post, :]
+            blocks = range_to_edge_id[ranges[0]:ranges[1], :]
+            total = int((blocks[:, 1] - blocks[:, 0]).sum()) if len(blocks) else 0
+
+            if total > 0:
+                ids_pre = _read_blocks(h5['source_node_id'], blocks, total)
                 row_ids = rv_index[rv_index.index.intersection(ids_pre)].values
                 indices.extend(row_ids)
-                data_pre = pandas.Series(numpy.hstack(data_pre), index=ids_pre)
+                data_pre = pandas.Series(_read_blocks(h5['0'][edge_property], blocks, total),
+                                         index=ids_pre)
                 data_pre = data_pre[data_pre.index.intersection(idx)]
                 res = data_pre.groupby(level=0, group_keys=False).agg(agg_func)  # here is the main difference from the above one
                 for agg_f in agg_func:
                     data[agg_f].extend(res[agg_f].to_numpy())
 
             indptr.append(len(indices))
+        indices, indptr = _as_index_arrays(indices, indptr, N)
         mats = {agg_f: sparse.csc_matrix((data[agg_f], indices, indptr), shape=(N, M)) for agg_f in agg_func}
         return mats
 
 
 def connection_matrix_for_gids(sonata_fn, gids, gids_post=None, population="default",
-                               edge_property=None, agg_func=None, load_full=False, **kwargs):
+                               edge_property=None, agg_func=None, load_full=False, edges=None,
+                               **kwargs):
     """
     Returns the connection matrix encoded in a sonata h5 file for a subset of neurons.
     Input:
@@ -188,6 +368,9 @@ def connection_matrix_for_gids(sonata_fn, gids, gids_post=None, population="defa
     agg_func: if a callable: A function to aggregate multiple synapse properties into a single,
                              scalar connection property (has to work with pandas' `.apply()`)
               if a list: A list of the above described aggregation functions (has to work with pandas' `.agg()`)
+    edges (optional): An already opened handle to the edge population: an h5py.Group when
+                      edge_property is used, a libsonata.EdgePopulation otherwise. Saves
+                      the file-open overhead when this is called many times on one file.
 
     Returns:
     scipy.sparse matrix of connectivity (or a dict of those if a list is passed as `agg_func`)
@@ -197,40 +380,76 @@ def connection_matrix_for_gids(sonata_fn, gids, gids_post=None, population="defa
     if load_full:
         M = full_connection_matrix(sonata_fn, population=population, edge_property=edge_property,
                                    agg_func=agg_func, **kwargs)
-        if isinstance(M, dict): return dict([(k, v.tocsr()[numpy.ix_(gids, gids_post)])
+        if isinstance(M, dict): return dict([(k, _submatrix(v, gids, gids_post))
                                              for k, v in M.items()])
-        return M.tocsr()[numpy.ix_(gids, gids_post)]
+        return _submatrix(M, gids, gids_post)
     if edge_property is not None:
         assert agg_func is not None, "When looking up connection properties, must provide an agg_func, such as mean"
         return _connection_property_for_gids(sonata_fn, gids, gids_post, population, edge_property,
-                                             agg_func, **kwargs)
-    
-    h5 = h5py.File(sonata_fn, "r")['edges/%s' % population]
-    idx = numpy.array(gids)
-    idx_post = numpy.array(gids_post)
+                                             agg_func, edges=edges, **kwargs)
+
+    pop = edges
+    if pop is None:
+        pop = libsonata.EdgeStorage(sonata_fn).open_population(population)
+    rv_index = pandas.Index(numpy.array(gids))
+    cv_index = pandas.Index(numpy.array(gids_post))
+    # get_indexer below requires unique labels; with duplicated gids build the matrix
+    # over the unique ones first and expand the duplicated rows / columns at the end
+    expand = rv_index.has_duplicates or cv_index.has_duplicates
+    uq_pre = rv_index.unique() if expand else rv_index
+    uq_post = cv_index.unique() if expand else cv_index
+
+    # One batched query for all post-synaptic nodes instead of a Python loop
+    # over them; the remaining work is a pair of C-level gathers.
+    sel = pop.afferent_edges(numpy.asarray(uq_post).tolist())
+    rows = uq_pre.get_indexer(pop.source_nodes(sel)).astype(numpy.int32)
+    cols = uq_post.get_indexer(pop.target_nodes(sel)).astype(numpy.int32)
+    mask = rows >= 0
+    mat = sparse.coo_matrix((numpy.ones(mask.sum(), dtype=bool), (rows[mask], cols[mask])),
+                            shape=(len(uq_pre), len(uq_post))).tocsc()
+    if expand:
+        mat = mat.tocsr()[uq_pre.get_indexer(rv_index)][:, uq_post.get_indexer(cv_index)].tocsc()
+    return mat
 
-    rv_index = pandas.Series(range(len(idx)), index=idx)
-    N = len(gids)
-    M = len(gids_post)
 
-    indices = []
-    indptr = [0]
-    for id_post in tqdm.tqdm(idx_post):
-        ids_pre = []
-        ranges = h5['indices']['target_to_source']['node_id_to_ranges'][id_post, :]
-        for block in h5['indices']['target_to_source']['range_to_edge_id'][ranges[0]:ranges[1], :]:
-            ids_pre.append(h5['source_node_id'][block[0]:block[1]])
-        if len(ids_pre) > 0:
-            row_ids = rv_index[rv_index.index.intersection(numpy.hstack(ids_pre))].values
-            indices.extend(row_ids)
-        indptr.append(len(indices))
-    mat = sparse.csc_matrix((numpy.ones(len(indices), dtype=bool), indices, indptr), shape=(N, M))
-    return mat
+def _submatrix(M, row_gids, col_gids, col_map=None):
+    """
+    Extracts M[numpy.ix_(row_gids, col_gids)] from a sparse matrix with a single gather
+    over the CSR index arrays, instead of two scipy __getitem__ passes that each touch
+    all nonzeros and allocate an intermediate matrix.
+    col_map (optional): reusable int32 buffer of length M.shape[1]; amortizes its
+    allocation when extracting many submatrices of the same parent.
+    """
+    M = M.tocsr()
+    row_gids = numpy.asarray(row_gids)
+    col_index = pandas.Index(col_gids)
+    if col_index.has_duplicates:
+        # col_map can hold only one output column per gid; extract the unique
+        # columns and expand the duplicated ones afterwards
+        uq = col_index.unique()
+        sub = _submatrix(M, row_gids, numpy.asarray(uq), col_map=col_map)
+        return sub.tocsc()[:, uq.get_indexer(col_index)].tocsr()
+    if col_map is None:
+        col_map = numpy.full(M.shape[1], -1, dtype=numpy.int32)
+    col_map[col_gids] = numpy.arange(len(col_gids), dtype=numpy.int32)
+    starts = M.indptr[row_gids]
+    cnt = M.indptr[row_gids + 1] - starts
+    total = int(cnt.sum())
+    # positions of all nonzeros of the selected rows within indices/data
+    offsets = numpy.concatenate([[0], numpy.cumsum(cnt)])[:len(cnt)]
+    pos = numpy.arange(total) + numpy.repeat(starts - offsets, cnt)
+    cols = col_map[M.indices[pos]]
+    rows = numpy.repeat(numpy.arange(len(row_gids), dtype=numpy.int32), cnt)
+    mask = cols >= 0
+    sub = sparse.csr_matrix((M.data[pos][mask], (rows[mask], cols[mask])),
+                            shape=(len(row_gids), len(col_gids)))
+    col_map[col_gids] = -1  # restore the buffer for the next call
+    return sub
 
 
 def circuit_connection_matrix(circ, connectome=LOCAL_CONNECTOME, for_gids=None, for_gids_post=None,
                               edge_population=None, node_population=None,
-                              edge_property=None, agg_func=None, chunk=50000000, load_full=False):
+                              edge_property=None, agg_func=None, chunk=50000000, load_full=None):
     """
     Returns a structural connection matrix, either for an entire circuit, or a subset of neurons.
     For either local connectivity or any projection. 
@@ -258,6 +477,10 @@ def circuit_connection_matrix(circ, connectome=LOCAL_CONNECTOME, for_gids=None,
               if a list: A list of the above described aggregation functions (has to work with pandas' `.agg()`)
     chunk (optional): Number of connections to read at the same time. Larger values will run generally faster,
                       but with fewer updates of the progress bar.
+    load_full (optional, bool): If True, extract the complete connection matrix first and slice the requested
+                      part out of it; if False, query the per-gid connectivity index instead. If not specified,
+                      this is decided automatically: small selections (below LOAD_FULL_FRACTION of the
+                      population) go through the per-gid index, large ones through the bulk read.
 
     Returns:
     scipy.sparse matrix of connectivity (or a dict of those if a list is passed as `agg_func`)
@@ -276,8 +499,17 @@ def circuit_connection_matrix(circ, connectome=LOCAL_CONNECTOME, for_gids=None,
     if for_gids is None:
         return full_connection_matrix(conn_file, edge_property=edge_property, agg_func=agg_func, shape=shape,
                                       population=edge_population, chunk=chunk)
+    if load_full is None:
+        # Per-gid index traversal wins for sparse selections; beyond a few percent of the
+        # population a single bulk read plus submatrix extraction is the faster shape.
+        n_post = len(for_gids) if for_gids_post is None else len(for_gids_post)
+        load_full = n_post >= LOAD_FULL_FRACTION * shape[1]
+    # The full matrix must be built with the known shape: inferring it from the edge
+    # data truncates the matrix when the highest-id nodes happen to have no edges.
+    kwargs = {"shape": shape} if load_full else {}
     return connection_matrix_for_gids(conn_file, for_gids, gids_post=for_gids_post, population=edge_population,
-                                      edge_property=edge_property, agg_func=agg_func, load_full=load_full, chunk=chunk)
+                                      edge_property=edge_property, agg_func=agg_func, load_full=load_full,
+                                      chunk=chunk, **kwargs)
 
 
 def circuit_node_set_matrix(circ, for_node_set, for_node_set_post=None):
@@ -303,7 +535,8 @@ def circuit_node_set_matrix(circ, for_node_set, for_node_set_post=None):
         if rel_pre and rel_post:
             tM = circuit_connection_matrix(circ, connectome=edge_name,
                                            for_gids=node_set_pre["node_ids"][edges.source.name],
-                                           for_gids_post=node_set_post["node_ids"][edges.target.name]).tocoo()
+                                           for_gids_post=node_set_post["node_ids"][edges.target.name],
+                                           load_full=False).tocoo()
             tgt_ids = node_set_post["index"][edges.target.name]
             src_ids = node_set_pre["index"][edges.source.name]
             
@@ -344,11 +577,15 @@ def circuit_group_matrices(circ, neuron_groups, connectome=LOCAL_CONNECTOME, ext
         neuron_groups = neuron_groups[column_gid]
     neuron_groups = neuron_groups.groupby(neuron_groups.index.names)
     if not extract_full:
+        # extract_full=False is the explicit opt-out of full-matrix extraction; do not
+        # let the per-group calls fall back to it through the load_full heuristic
+        kwargs.setdefault("load_full", False)
         matrices = neuron_groups.apply(lambda grp: circuit_connection_matrix(circ, connectome=connectome,
                                                                              for_gids=grp.values, **kwargs))
     else:
         full_matrix = circuit_connection_matrix(circ, connectome=connectome, **kwargs)
-        matrices = neuron_groups.apply(lambda grp: full_matrix[numpy.ix_(grp.values, grp.values)])
+        col_map = numpy.full(full_matrix.shape[1], -1, dtype=numpy.int32)
+        matrices = neuron_groups.apply(lambda grp: _submatrix(full_matrix, grp.values, grp.values, col_map))
     matrices = matrices[matrices.apply(lambda x: isinstance(x, sparse.spmatrix))]
     return matrices
 
@@ -387,10 +624,11 @@ def circuit_cross_group_matrices(circ, neuron_groups_pre, neuron_groups_post, co
     """
     if extract_full:
         full_matrix = circuit_connection_matrix(circ, connectome=connectome, **kwargs)
+        col_map = numpy.full(full_matrix.shape[1], -1, dtype=numpy.int32)
 
         def prepare_indexing(df_pre):
             def index_submat(df_post):
-                return full_matrix[numpy.ix_(df_pre[column_gid].values, df_post[column_gid].values)]
+                return _submatrix(full_matrix, df_pre[column_gid].values, df_post[column_gid].values, col_map)
             return index_submat
 
         res = neuron_groups_pre.groupby(neuron_groups_pre.index.names).apply(
@@ -399,75 +637,162 @@ def circuit_cross_group_matrices(circ, neuron_groups_pre, neuron_groups_post, co
         )
         return res
 
+    # Resolve the connectome and open the edge population once, instead of once per
+    # (pre group, post group) pair -- on large group lattices that is O(G^2) file opens.
+    if connectome == LOCAL_CONNECTOME:
+        from .sonata_helpers import local_connectome_for, nonvirtual_node_population
+        node_population = kwargs.pop("node_population", None)
+        if node_population is None: node_population = nonvirtual_node_population(circ)
+        connectome = local_connectome_for(circ, node_population)
+    else:
+        kwargs.pop("node_population", None)
+    conn_file = find_sonata_connectome(circ, connectome)
+    edge_population = kwargs.pop("edge_population", None)
+    if edge_population is None:
+        edge_population = connectome
+    h5_file = None
+    if kwargs.get("edge_property") is not None:
+        h5_file = h5py.File(conn_file, "r", rdcc_nbytes=RDCC_NBYTES)
+        edges = h5_file['edges/%s' % edge_population]
+    else:
+        edges = libsonata.EdgeStorage(conn_file).open_population(edge_population)
+
     def prepare_con_mat(df_pre):
         def execute_con_mat(df_post):
             if len(df_pre) == 0 or len(df_post) == 0:
                 _shape = (len(df_pre), len(df_post))
                 return sparse.csc_matrix(numpy.empty(shape=_shape, dtype=bool))
-            return circuit_connection_matrix(circ, for_gids=df_pre[column_gid].values,
-                                             for_gids_post=df_post[column_gid].values,
-                                             connectome=connectome, **kwargs)
+            return connection_matrix_for_gids(conn_file, df_pre[column_gid].values,
+                                              gids_post=df_post[column_gid].values,
+                                              population=edge_population, edges=edges, **kwargs)
 
         return execute_con_mat
 
-    res = neuron_groups_pre.groupby(neuron_groups_pre.index.names).apply(
-        lambda df_pre:
-        neuron_groups_post.groupby(neuron_groups_post.index.names).apply(prepare_con_mat(df_pre))
-    )
+    try:
+        res = neuron_groups_pre.groupby(neuron_groups_pre.index.names).apply(
+            lambda df_pre:
+            neuron_groups_post.groupby(neuron_groups_post.index.names).apply(prepare_con_mat(df_pre))
+        )
+    finally:
+        if h5_file is not None:
+            h5_file.close()
     return res
 
 
 def _make_node_lookup(circ, neuron_groups, column_gid, fill_unused_gids=True):
+    """
+    With fill_unused_gids=False, returns a pandas.Series of group membership strings indexed
+    by gid. With fill_unused_gids=True, returns the equivalent (categories, code_by_gid)
+    pair, where code_by_gid is a dense gid-indexed array of category codes with -1 marking
+    gids that belong to no group. This avoids ever materializing the all-STR_VOID filler
+    Series and the Categorical rebuild over millions of entries.
+    """
     from .neuron_groups import flip
     node_lookup = flip(neuron_groups, index=column_gid, contract_values=True, categorical=~fill_unused_gids)
     if fill_unused_gids:
         node_ids = circ.nodes.ids()
         all_gids = node_ids.index.to_frame()[GID].values
-        missing_gids = numpy.setdiff1d(all_gids, node_lookup.index)
-        full_lookup = pandas.concat([node_lookup,
-                                     pandas.Series([STR_VOID] * len(missing_gids),
-                                                   index=missing_gids)], axis=0)
-        node_lookup = pandas.Series(pandas.Categorical(full_lookup), index=full_lookup.index, name=node_lookup.name)
+        cat = pandas.Categorical(node_lookup.values)
+        sz = int(max(all_gids.max(), node_lookup.index.max())) + 1
+        code_by_gid = numpy.full(sz, -1, dtype=numpy.int32)
+        code_by_gid[node_lookup.index.values] = cat.codes
+        return cat.categories, code_by_gid
     return node_lookup
 
 
-def connection_matrix_between_groups_partition(sonata_fn, node_lookup, population, chunk=50000000):
+def connection_matrix_between_groups_partition(sonata_fn, node_lookup, population, chunk=50000000,
+                                               n_workers=4):
     # TODO: If the user accidently provides a "neuron_groups" instead of "node_lookup" input give helpful message
     # TODO: Evaluate if it is necessary to fill node_lookup for unused gids with STR_VOID
     """
     Don't use this. Use circuit_matrix_between_groups
     """
-    h5 = h5py.File(sonata_fn, "r")['edges/{0}'.format(population)]  # TODO: close file!
-
-    dset_sz = h5['source_node_id'].shape[0]
+    with h5py.File(sonata_fn, "r") as h5:
+        dset_sz = h5['edges/{0}'.format(population)]['source_node_id'].shape[0]
     splits = numpy.arange(0, dset_sz + chunk, chunk)
+    splits[-1] = dset_sz
+    bounds = list(zip(splits[:-1], splits[1:]))
+    get_dsets, close_dsets = _thread_local_edge_datasets(sonata_fn, population, min(chunk, dset_sz))
 
-    midxx = pandas.MultiIndex.from_tuples([], names=["Source node", "Target node"])
-    counts = pandas.Series([], index=midxx, dtype=int)
-
-    for splt_fr, splt_to in tqdm.tqdm(zip(splits[:-1], splits[1:]), desc="Counting...", total=len(splits) - 1):
-        son_idx_fr = h5['source_node_id'][splt_fr:splt_to]
-        son_idx_to = h5['target_node_id'][splt_fr:splt_to]
-        reg_fr = node_lookup[son_idx_fr]
-        reg_to = node_lookup[son_idx_to]
-        new_counts = pandas.DataFrame({"Source node": reg_fr.values,
-                                       "Target node": reg_to.values}).value_counts()
-        counts = counts.add(new_counts, fill_value=0)
-
-    for lvl, nm in zip(counts.index.levels, counts.index.names):
-        if STR_VOID in lvl:
-            counts = counts.drop(STR_VOID, level=nm)
+    if isinstance(node_lookup, tuple):  # (categories, code_by_gid), see _make_node_lookup
+        categories, code_by_gid = node_lookup
+        categories = pandas.Index(categories)
+    else:
+        node_lookup = node_lookup.astype("category")
+        categories = node_lookup.cat.categories
+        # Dense gid -> category code array. Indexing it is a single C-level gather,
+        # where label-based pandas lookup would hash and box every node id.
+        code_by_gid = numpy.full(int(node_lookup.index.max()) + 1, -1, dtype=numpy.int32)
+        code_by_gid[node_lookup.index.values] = node_lookup.cat.codes.values
+    K = len(categories)
+    # Fixed-size dense accumulator: one bincount per chunk on linearized
+    # (source category, target category) indices, no per-chunk hashing. For very
+    # fine groupings where a dense K x K matrix would be large, accumulate sparse
+    # per-chunk count matrices instead; csr + csr is a single C-level pass.
+    use_dense = K * K <= 2 ** 24
+    if use_dense:
+        acc = numpy.zeros(K * K, dtype=numpy.int64)
+    else:
+        acc = sparse.csr_matrix((K, K), dtype=numpy.int64)
+
+    def count_chunk(chunk_bounds):
+        splt_fr, splt_to = chunk_bounds
+        src_dset, tgt_dset, buf_src, buf_tgt = get_dsets()
+        cat_fr = code_by_gid[_read_slice(src_dset, splt_fr, splt_to, buf_src)].astype(numpy.int64)
+        cat_to = code_by_gid[_read_slice(tgt_dset, splt_fr, splt_to, buf_tgt)]
+        valid = (cat_fr >= 0) & (cat_to >= 0)
+        if use_dense:
+            flat = cat_fr * K + cat_to
+            return numpy.bincount(flat[valid], minlength=K * K)
+        return sparse.coo_matrix((numpy.ones(int(valid.sum()), dtype=numpy.int64),
+                                  (cat_fr[valid], cat_to[valid])), shape=(K, K)).tocsr()
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for chunk_counts in tqdm.tqdm(pool.map(count_chunk, bounds), desc="Counting...", total=len(bounds)):
+            acc = acc + chunk_counts
+    close_dsets()
+
+    if use_dense:
+        acc = acc.reshape((K, K))
+        nz_fr, nz_to = numpy.nonzero(acc)
+        nz_counts = acc[nz_fr, nz_to]
+    else:
+        acc = acc.tocoo()
+        nz_fr, nz_to, nz_counts = acc.row, acc.col, acc.data
+    # Drop VOID pairs with one boolean mask over the category codes, instead of
+    # one Series.drop per index level, each of which rebuilds the MultiIndex.
+    if STR_VOID in categories:
+        void_code = categories.get_loc(STR_VOID)
+        keep = (nz_fr != void_code) & (nz_to != void_code)
+        nz_fr, nz_to, nz_counts = nz_fr[keep], nz_to[keep], nz_counts[keep]
+    counts = pandas.Series(nz_counts,
+                           index=pandas.MultiIndex.from_arrays([categories[nz_fr], categories[nz_to]],
+                                                               names=["Source node", "Target node"]))
     return counts
 
 
-def _afferent_gids(h5, post_gid):
-    rnge = h5["indices"]["target_to_source"]["node_id_to_ranges"][post_gid]
-    if rnge[1] == rnge[0]:
-        return numpy.array([])
-    son_idx_fr = [h5["source_node_id"][r[0]:r[1]]
-                  for r in h5["indices"]["target_to_source"]["range_to_edge_id"][rnge[0]:rnge[1]]]
-    son_idx_fr = numpy.hstack(son_idx_fr)
-    return son_idx_fr
+def _afferent_gids(h5, post_gids, node_id_to_ranges, range_to_edge_id):
+    """
+    Source node ids of all edges afferent to the given post-synaptic nodes. All edge-id
+    ranges of all nodes are collected first, sorted and merged where they touch, then read
+    with one sequential HDF5 read per merged run instead of one small read per range.
+    """
+    blocks = [range_to_edge_id[fr:to] for fr, to in node_id_to_ranges[post_gids]]
+    blocks = numpy.concatenate(blocks) if len(blocks) else numpy.zeros((0, 2), dtype=numpy.int64)
+    if len(blocks) == 0:
+        return numpy.array([], dtype=h5["source_node_id"].dtype)
+    starts = blocks[:, 0]
+    stops = blocks[:, 1]
+    order = numpy.argsort(starts, kind="stable")
+    starts = starts[order]
+    stops = stops[order]
+    # a merged run ends where the next range does not touch the running maximum stop
+    run_stop = numpy.maximum.accumulate(stops)
+    new_run = numpy.concatenate([[True], starts[1:] > run_stop[:-1]])
+    merged_fr = starts[new_run]
+    merged_to = numpy.maximum.reduceat(stops, numpy.flatnonzero(new_run))
+    return _read_blocks(h5["source_node_id"], zip(merged_fr, merged_to),
+                        int((merged_to - merged_fr).sum()))
 
 
 def connection_matrix_between_groups_partial(sonata_fn, node_lookup, population="default", **kwargs):
@@ -478,21 +803,39 @@ def connection_matrix_between_groups_partial(sonata_fn, node_lookup, population=
     node_lookup = node_lookup[node_lookup != STR_VOID]
     gids_per_node = node_lookup.to_frame().groupby(node_lookup.name).apply(lambda x: x.index.values)
 
+    # Dense gid -> category code array: O(1) membership tests and counting per source id
+    # instead of an in1d sort and a value_counts for every target group.
+    cat = pandas.Categorical(node_lookup.values)
+    mask_sz = int(node_lookup.index.max()) + 1
+    code_by_gid = numpy.full(mask_sz, -1, dtype=numpy.int32)
+    code_by_gid[node_lookup.index.values] = cat.codes
+    n_cats = len(cat.categories)
+
     lst_node_to = []
+    lst_codes_from = []
     lst_counts_from = []
     with h5py.File(sonata_fn, "r") as h5_file:
         h5 = h5_file['edges/{0}'.format(population)]
+        # The two bookkeeping index datasets are small compared to the edge arrays;
+        # load them once instead of hitting HDF5 for every post-synaptic node.
+        node_id_to_ranges = h5["indices"]["target_to_source"]["node_id_to_ranges"][:]
+        range_to_edge_id = h5["indices"]["target_to_source"]["range_to_edge_id"][:]
         for node_to, lst_post_gids in tqdm.tqdm(gids_per_node.items(), total=len(gids_per_node)):
-            lst_pre_gids = [_afferent_gids(h5, post_gid) for post_gid in lst_post_gids]
-            lst_pre_gids = numpy.hstack(lst_pre_gids)
-            lst_pre_gids = lst_pre_gids[numpy.in1d(lst_pre_gids, node_lookup.index)]
-            node_from = node_lookup[lst_pre_gids]
-            counts_from = node_from.value_counts()
-            counts_from.index.name = "Source node"
-            lst_node_to.append(node_to)
-            lst_counts_from.append(counts_from)
-    counts = pandas.concat(lst_counts_from, keys=lst_node_to, names=["Target node"])
-
+            lst_pre_gids = _afferent_gids(h5, lst_post_gids, node_id_to_ranges, range_to_edge_id)
+            lst_pre_gids = lst_pre_gids[lst_pre_gids < mask_sz]
+            codes_from = code_by_gid[lst_pre_gids]
+            counts_from = numpy.bincount(codes_from[codes_from >= 0], minlength=n_cats)
+            nz = numpy.flatnonzero(counts_from)
+            lst_node_to.append(numpy.full(len(nz), len(lst_node_to), dtype=numpy.int32))
+            lst_codes_from.append(nz.astype(numpy.int32))
+            lst_counts_from.append(counts_from[nz])
+    # Assemble the result in one go instead of concatenating one Series per target
+    # group, which would rebuild the MultiIndex at every step.
+    idx_to = pandas.Index(gids_per_node.index)[numpy.concatenate(lst_node_to)]
+    idx_from = cat.categories[numpy.concatenate(lst_codes_from)]
+    counts = pandas.Series(numpy.concatenate(lst_counts_from),
+                           index=pandas.MultiIndex.from_arrays([idx_to, idx_from],
+                                                               names=["Target node", "Source node"]))
     return counts
 
 
@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: Apache-2.0
+import os
+import h5py
+import numpy
+import pandas
+
+from contextlib import contextmanager
+
+from conntility.circuit_models import connection_matrix as test_module
+
+from utils import setup_tempdir
+
+N_NODES = 35  # deliberately larger than the highest node id touched by any edge
+N_EDGES = 300
+
+numpy.random.seed(42)
+SRC = numpy.random.randint(0, 30, N_EDGES)
+TGT = numpy.random.randint(0, 30, N_EDGES)
+# sort by target so the target_to_source index is made of contiguous ranges
+_order = numpy.argsort(TGT, kind="stable")
+SRC, TGT = SRC[_order], TGT[_order]
+U = numpy.random.rand(N_EDGES)
+
+ADJ = numpy.zeros((N_NODES, N_NODES), dtype=bool)
+ADJ[SRC, TGT] = True
+SYN_COUNT = numpy.zeros((N_NODES, N_NODES), dtype=int)
+numpy.add.at(SYN_COUNT, (SRC, TGT), 1)
+SYN_SUM = numpy.zeros((N_NODES, N_NODES))
+numpy.add.at(SYN_SUM, (SRC, TGT), U)
+
+
+def _write_sonata_edges(fn, population="default"):
+    n2r = numpy.zeros((N_NODES, 2), dtype=numpy.uint64)
+    r2e = []
+    pos = 0
+    for t in range(N_NODES):
+        cnt = int((TGT == t).sum())
+        n2r[t, 0] = len(r2e)
+        if cnt > 3:  # split into two ranges to exercise multi-range walks
+            mid = pos + cnt // 2
+            r2e.append([pos, mid]); r2e.append([mid, pos + cnt])
+        elif cnt > 0:
+            r2e.append([pos, pos + cnt])
+        n2r[t, 1] = len(r2e)
+        pos += cnt
+    s_n2r = numpy.zeros((N_NODES, 2), dtype=numpy.uint64)
+    s_r2e = []
+    for s in range(N_NODES):
+        eids = numpy.flatnonzero(SRC == s)
+        s_n2r[s, 0] = len(s_r2e)
+        if len(eids):
+            breaks = numpy.flatnonzero(numpy.diff(eids) != 1)
+            starts = numpy.concatenate([[0], breaks + 1])
+            stops = numpy.concatenate([breaks + 1, [len(eids)]])
+            for a, b in zip(starts, stops):
+                s_r2e.append([eids[a], eids[b - 1] + 1])
+        s_n2r[s, 1] = len(s_r2e)
+    with h5py.File(fn, "w") as h5:
+        grp = h5.create_group("edges/{0}".format(population))
+        ds = grp.create_dataset("source_node_id", data=SRC.astype(numpy.uint64))
+        ds.attrs["node_population"] = "nodes"
+        dt = grp.create_dataset("target_node_id", data=TGT.astype(numpy.uint64))
+        dt.attrs["node_population"] = "nodes"
+        grp.create_dataset("edge_type_id", data=numpy.full(N_EDGES, -1, dtype=numpy.int64))
+        grp.create_dataset("0/u", data=U)
+        idx = grp.create_group("indices")
+        idx.create_dataset("target_to_source/node_id_to_ranges", data=n2r)
+        idx.create_dataset("target_to_source/range_to_edge_id",
+                           data=numpy.array(r2e, dtype=numpy.uint64))
+        idx.create_dataset("source_to_target/node_id_to_ranges", data=s_n2r)
+        idx.create_dataset("source_to_target/range_to_edge_id",
+                           data=numpy.array(s_r2e, dtype=numpy.uint64))
+
+
+@contextmanager
+def sonata_edge_file():
+    with setup_tempdir() as tmp_dir:
+        fn = os.path.join(tmp_dir, "edges.h5")
+        _write_sonata_edges(fn)
+        yield fn
+
+
+def test_full_connection_matrix():
+    with sonata_edge_file() as fn:
+        M = test_module.full_connection_matrix(fn, shape=(N_NODES, N_NODES),
+                                               chunk=64, n_workers=3)
+        assert M.shape == (N_NODES, N_NODES)
+        assert (M.toarray() == ADJ).all()
+        # without a shape it is inferred from the edge data
+        n = int(max(SRC.max(), TGT.max())) + 1
+        M = test_module.full_connection_matrix(fn, chunk=64, n_workers=2)
+        assert M.shape == (n, n)
+        assert (M.toarray() == ADJ[:n, :n]).all()
+
+
+def test_full_connection_matrix_property():
+    with sonata_edge_file() as fn:
+        M = test_module.full_connection_matrix(fn, edge_property="u", agg_func=["sum"],
+                                               shape=(N_NODES, N_NODES), chunk=64)
+        assert numpy.allclose(M["sum"].toarray(), SYN_SUM)
+
+
+def test_connection_matrix_for_gids():
+    gids = [3, 0, 7, 12, 25]
+    gids_post = [5, 3, 19]
+    with sonata_edge_file() as fn:
+        M = test_module.connection_matrix_for_gids(fn, gids, gids_post=gids_post)
+        assert (M.toarray() == ADJ[numpy.ix_(gids, gids_post)]).all()
+        M = test_module.connection_matrix_for_gids(fn, gids, gids_post=gids_post, load_full=True)
+        assert (M.toarray() == ADJ[numpy.ix_(gids, gids_post)]).all()
+        M = test_module.connection_matrix_for_gids(fn, gids, gids_post=gids_post,
+                                                   edge_property="u", agg_func=len)
+        assert (M.toarray() == SYN_COUNT[numpy.ix_(gids, gids_post)]).all()
+
+
+def test_connection_matrix_for_gids_duplicates():
+    # duplicated gids yield duplicated rows / columns rather than an error
+    gids = [3, 7, 3, 12]
+    gids_post = [5, 5, 19]
+    with sonata_edge_file() as fn:
+        M = test_module.connection_matrix_for_gids(fn, gids, gids_post=gids_post)
+        assert (M.toarray() == ADJ[numpy.ix_(gids, gids_post)]).all()
+        M = test_module.connection_matrix_for_gids(fn, gids, gids_post=gids_post, load_full=True)
+        assert (M.toarray() == ADJ[numpy.ix_(gids, gids_post)]).all()
+
+
+class _MockNodes:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+class _MockEdgePopulation:
+    def __init__(self, h5_filepath, size):
+        self.h5_filepath = h5_filepath
+        self.source = _MockNodes("nodes", size)
+        self.target = _MockNodes("nodes", size)
+
+
+class _MockCircuit:
+    def __init__(self, edge_fn):
+        self.edges = {"default": _MockEdgePopulation(edge_fn, N_NODES)}
+
+
+def test_circuit_connection_matrix_load_full():
+    # a selection large enough to trigger the automatic load_full path must still
+    # use the population size, not a shape inferred from the edge data: nodes 30
+    # and up have no edges at all
+    gids = numpy.arange(N_NODES)
+    with sonata_edge_file() as fn:
+        M = test_module.circuit_connection_matrix(_MockCircuit(fn), connectome="default",
+                                                  for_gids=gids)
+        assert M.shape == (N_NODES, N_NODES)
+        assert (M.toarray() == ADJ).all()
+
+
+def test_circuit_connection_matrix_property():
+    # a single post gid stays below the load_full threshold and must go
+    # through the indexed property reader
+    gids = [3, 0, 7]
+    with sonata_edge_file() as fn:
+        M = test_module.circuit_connection_matrix(_MockCircuit(fn), connectome="default",
+                                                  for_gids=gids, for_gids_post=[5],
+                                                  edge_property="u", agg_func=len)
+        assert (M.toarray() == SYN_COUNT[numpy.ix_(gids, [5])]).all()
+
+
+def test_circuit_group_matrices(monkeypatch):
+    grp = pandas.DataFrame({test_module.GID: numpy.arange(30)},
+                           index=pandas.Index(["A"] * 15 + ["B"] * 15, name="grp"))
+    with sonata_edge_file() as fn:
+        circ = _MockCircuit(fn)
+        # extract_full=False opts out of full-matrix extraction; the per-group calls
+        # must not fall back to it through the load_full heuristic
+        def _no_full_read(*args, **kwargs):
+            raise AssertionError("full matrix read on the extract_full=False path")
+        monkeypatch.setattr(test_module, "full_connection_matrix", _no_full_read)
+        matrices = test_module.circuit_group_matrices(circ, grp, connectome="default")
+        assert (matrices["A"].toarray() == ADJ[:15, :15]).all()
+        assert (matrices["B"].toarray() == ADJ[15:30, 15:30]).all()
+
+
+def test_connection_matrix_between_groups():
+    labels = numpy.array(["A", "B", "C", test_module.STR_VOID], dtype=object)
+    node_lookup = pandas.Series(labels[numpy.arange(30) % 4], index=numpy.arange(30),
+                                name="grp")
+    expected = {}
+    for s, t in zip(SRC, TGT):
+        pair = (node_lookup[s], node_lookup[t])
+        if test_module.STR_VOID not in pair:
+            expected[pair] = expected.get(pair, 0) + 1
+    with sonata_edge_file() as fn:
+        counts = test_module.connection_matrix_between_groups_partition(fn, node_lookup,
+                                                                        population="default",
+                                                                        chunk=64)
+        assert counts.to_dict() == expected
+        counts = test_module.connection_matrix_between_groups_partial(fn, node_lookup,
+                                                                      population="default")
+        assert counts.to_dict() == dict([((t, s), v) for (s, t), v in expected.items()])
+
+
+def test_connection_matrix_between_groups_empty_afferent():
+    # nodes 30 and up receive no edges at all; a group made only of them must
+    # simply contribute no counts instead of crashing on the empty lookup
+    node_lookup = pandas.Series(["A"] * 30 + ["B"] * (N_NODES - 30),
+                                index=numpy.arange(N_NODES), name="grp")
+    with sonata_edge_file() as fn:
+        counts = test_module.connection_matrix_between_groups_partial(fn, node_lookup,
+                                                                      population="default")
+        assert counts.to_dict() == {("A", "A"): N_EDGES}